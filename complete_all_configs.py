@@ -4,59 +4,314 @@ Complete all KDL config snippets into full valid configurations.
 Intelligently detects what's present and adds only what's needed.
 """
 
-import re
+import asyncio
+import functools
+import hashlib
+import sqlite3
+from contextlib import closing, contextmanager
 from pathlib import Path
 import subprocess
 import tempfile
 import os
 
+from kdl_docs import (
+    WRAPPER_SENTINEL, block_openers, collect_kdl_blocks, find_markdown_files,
+    is_complete_config, is_well_formed, read_kdl_markdown, replace_kdl_blocks,
+)
+
 DOCS_DIR = Path("/Users/zara/Development/github.com/zentinelproxy/zentinelproxy.io-docs/content")
 ZENTINEL_BIN = "/Users/zara/.cargo/bin/zentinel"
+# Seconds a single `zentinel --test` may take before it counts as not run
+ZENTINEL_TIMEOUT = 3
+
+# Validation results persisted across runs, scoped to the zentinel version
+CACHE_DB = Path(os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache') / 'kdl-validator' / 'cache.sqlite'
+
+# Common syntax example keywords
+SYNTAX_KEYWORDS = frozenset({
+    'name', 'port', 'weight', 'enabled', 'disabled',
+    'optional-field', 'key', 'value', 'my-field',
+})
+
+# Minimal config zentinel accepts, used to probe for stdin support
+PROBE_CONFIG = """system {
+    worker-threads 0
+}
+
+listeners {
+    listener "http" {
+        address "0.0.0.0:8080"
+        protocol "http"
+    }
+}
+
+routes {
+    route "default" {
+        matches { path-prefix "/" }
+        upstream "backend"
+    }
+}
+
+upstreams {
+    upstream "backend" {
+        targets {
+            target { address "127.0.0.1:3000" }
+        }
+    }
+}
+"""
+
+# Validation results keyed by cache_key() (zentinel's verdict is deterministic)
+TEST_CACHE = {}
+# Keys of configs zentinel couldn't be run on (spawn failure, timeout). They
+# count as invalid for this run but are never cached or persisted.
+FAILED_KEYS = set()
+# Keys whose results are already stored in CACHE_DB
+PERSISTED_KEYS = set()
 
 def test_config(config_text):
-    """Test if a config is valid."""
+    """Test if a config is valid, reusing earlier results for identical text."""
+    key = cache_key(config_text)
+    result = TEST_CACHE.get(key)
+    if result is None:
+        if key in FAILED_KEYS:
+            return False
+        result = check_config(config_text)
+        if result is None:
+            FAILED_KEYS.add(key)
+            return False
+        TEST_CACHE[key] = result
+    return result
+
+def cache_key(config_text):
+    """Key a config's validation result by a digest of its text."""
+    return hashlib.blake2b(config_text.encode(), digest_size=16).digest()
+
+@functools.lru_cache(maxsize=None)
+def zentinel_version():
+    """Get `zentinel --version`, or '' if zentinel can't be run."""
+    try:
+        return subprocess.run(
+            [ZENTINEL_BIN, '--version'],
+            capture_output=True,
+            text=True,
+            timeout=3
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ''
+
+def open_cache_db():
+    """Open CACHE_DB, creating it if needed."""
+    CACHE_DB.parent.mkdir(parents=True, exist_ok=True)
+    db = sqlite3.connect(CACHE_DB)
+    db.execute(
+        'CREATE TABLE IF NOT EXISTS results '
+        '(version TEXT, key BLOB, valid INTEGER, PRIMARY KEY (version, key))'
+    )
+    return db
+
+def load_validation_cache():
+    """Load results from earlier runs with this zentinel version into TEST_CACHE.
+
+    The cache is only a speed-up: if it can't be read, every config is
+    validated from scratch.
+    """
+    version = zentinel_version()
+    if not version:
+        return
+    try:
+        with closing(open_cache_db()) as db:
+            rows = db.execute(
+                'SELECT key, valid FROM results WHERE version = ?', (version,)
+            ).fetchall()
+    except (OSError, sqlite3.Error) as e:
+        print(f"⚠ Validation cache {CACHE_DB} unavailable, not using it: {e}")
+        return
+    for key, valid in rows:
+        TEST_CACHE[key] = bool(valid)
+        PERSISTED_KEYS.add(key)
+
+def save_validation_cache():
+    """Persist new results to CACHE_DB, dropping those of other zentinel versions."""
+    version = zentinel_version()
+    if not version:
+        return
+    rows = [(version, key, int(valid)) for key, valid in TEST_CACHE.items()
+            if key not in PERSISTED_KEYS]
+    try:
+        with closing(open_cache_db()) as db:
+            with db:
+                db.execute('DELETE FROM results WHERE version != ?', (version,))
+                db.executemany('INSERT OR REPLACE INTO results VALUES (?, ?, ?)', rows)
+    except (OSError, sqlite3.Error) as e:
+        # The docs are already rewritten; only the speed-up for next time is lost
+        print(f"⚠ Could not save validation cache {CACHE_DB}: {e}")
+        return
+    PERSISTED_KEYS.update(row[1] for row in rows)
+
+def check_config(config_text):
+    """Validate a config, rejecting malformed KDL without running zentinel.
+
+    Returns None if zentinel couldn't be run.
+    """
+    return is_well_formed(config_text) and run_zentinel_test(config_text)
+
+def run_zentinel_test(config_text):
+    """Run `zentinel --test` against a config."""
+    with zentinel_conf(config_text) as (conf_args, stdin):
+        return zentinel_test(conf_args, stdin)
+
+@contextmanager
+def zentinel_conf(config_text):
+    """Yield (conf_args, stdin) for passing config_text to zentinel.
+
+    The config is piped in when zentinel supports `--conf -`, to avoid a
+    temp file per check; otherwise it goes through a temp file.
+    """
+    if supports_stdin_conf():
+        yield ['--conf', '-'], config_text.encode()
+        return
+
     with tempfile.NamedTemporaryFile(mode='w', suffix='.kdl', delete=False) as f:
         f.write(config_text)
         temp_file = f.name
+    try:
+        yield ['--conf', temp_file], None
+    finally:
+        os.unlink(temp_file)
+
+@functools.lru_cache(maxsize=None)
+def supports_stdin_conf():
+    """Check once whether zentinel reads `--conf -` from stdin."""
+    return zentinel_test(['--conf', '-'], PROBE_CONFIG.encode())
+
+def zentinel_test(conf_args, stdin=None):
+    """Run `zentinel <conf_args> --test`, returning True if it passes.
+
+    Returns None if zentinel couldn't be run or timed out.
+    """
     try:
         result = subprocess.run(
-            [ZENTINEL_BIN, '--conf', temp_file, '--test'],
+            [ZENTINEL_BIN, *conf_args, '--test'],
+            input=stdin,
             capture_output=True,
-            timeout=3
+            timeout=ZENTINEL_TIMEOUT
         )
         return result.returncode == 0
-    except:
-        return False
-    finally:
-        os.unlink(temp_file)
+    except (OSError, subprocess.SubprocessError):
+        return None
 
-def has_block(config, block_name):
-    """Check if config has a top-level block."""
-    pattern = rf'^\s*{block_name}\s*\{{'
-    return bool(re.search(pattern, config, re.MULTILINE))
+async def run_zentinel_test_async(config_text):
+    """Run `zentinel --test` against a config without blocking the event loop."""
+    with zentinel_conf(config_text) as (conf_args, stdin):
+        return await zentinel_test_async(conf_args, stdin)
+
+async def zentinel_test_async(conf_args, stdin=None):
+    """Async counterpart of zentinel_test()."""
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            ZENTINEL_BIN, *conf_args, '--test',
+            stdin=asyncio.subprocess.PIPE if stdin is not None else asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+    except OSError:
+        return None
+    try:
+        await asyncio.wait_for(proc.communicate(stdin), timeout=ZENTINEL_TIMEOUT)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        return None
+    return proc.returncode == 0
+
+async def check_configs_async(configs):
+    """Validate configs concurrently, with at most one zentinel per CPU."""
+    limit = asyncio.Semaphore(os.cpu_count() or 1)
+
+    async def check(config_text):
+        if not is_well_formed(config_text):
+            return False
+        async with limit:
+            return await run_zentinel_test_async(config_text)
+
+    return await asyncio.gather(*(check(c) for c in configs))
+
+def prevalidate(configs):
+    """Validate many configs concurrently, filling TEST_CACHE."""
+    pending = {}
+    for config_text in configs:
+        key = cache_key(config_text)
+        if key not in TEST_CACHE and key not in FAILED_KEYS:
+            pending[key] = config_text
+    if not pending:
+        return
+
+    results = asyncio.run(check_configs_async(list(pending.values())))
+    for key, result in zip(pending, results):
+        # Configs zentinel couldn't run on are retried one at a time later
+        if result is not None:
+            TEST_CACHE[key] = result
+
+def is_valid_config(config):
+    """Check if a config is valid, skipping zentinel for obviously partial ones."""
+    return is_complete_config(config) and test_config(config)
 
 def get_first_word(config):
-    """Get the first keyword in the config."""
-    match = re.search(r'^\s*(\w+)', config.strip(), re.MULTILINE)
-    return match.group(1) if match else None
+    """Get the first keyword in the config.
+
+    Lines that don't start with an identifier (comments, strings) are
+    skipped, so this is the first node name in the snippet.
+    """
+    n = len(config)
+    i = 0
+    while i < n:
+        while i < n and config[i] in ' \t\r\n':
+            i += 1
+        j = i
+        while j < n and (config[j].isalnum() or config[j] == '_' or (j > i and config[j] == '-')):
+            j += 1
+        if j > i:
+            return config[i:j]
+        i = config.find('\n', i)
+        if i == -1:
+            break
+    return None
 
 def is_syntax_example(config):
     """Check if this is a pure KDL syntax example (not a real config)."""
-    first_word = get_first_word(config)
-    # Common syntax example keywords
-    syntax_keywords = ['name', 'port', 'weight', 'enabled', 'disabled',
-                       'optional-field', 'key', 'value', 'my-field']
-    return first_word in syntax_keywords
+    return get_first_word(config) in SYNTAX_KEYWORDS
 
+@functools.lru_cache(maxsize=None)
 def complete_config(config):
     """Complete a partial config by adding missing required blocks."""
+    # Skip our own output from an earlier run
+    if WRAPPER_SENTINEL in config:
+        return config
+
     # Skip if already valid
-    if test_config(config):
+    if is_valid_config(config):
         return config
 
-    # Skip syntax examples - wrap them in a comment block
+    completed = build_completion(config)
+
+    # Syntax examples are only wrapped for display, not validated
+    if is_syntax_example(config):
+        return completed
+
+    # Test if completion worked
+    if test_config(completed):
+        return completed
+
+    # If still invalid, return original (we'll report it)
+    return config
+
+def build_completion(config):
+    """Build the completed form of a partial config without validating it."""
+    # Syntax examples - wrap them in a comment block
     if is_syntax_example(config):
-        return f"""// KDL Syntax Example (not a complete config)
+        return f"""{WRAPPER_SENTINEL}
+// KDL Syntax Example (not a complete config)
 system {{
     worker-threads 0
 }}
@@ -87,16 +342,17 @@ upstreams {{
 // {config}
 """
 
+    blocks = block_openers(config)
     parts = []
 
     # Add system if missing
-    if not has_block(config, 'system'):
+    if 'system' not in blocks:
         parts.append("""system {
     worker-threads 0
 }""")
 
     # Add listeners if missing
-    if not has_block(config, 'listeners'):
+    if 'listeners' not in blocks:
         parts.append("""listeners {
     listener "http" {
         address "0.0.0.0:8080"
@@ -108,8 +364,8 @@ upstreams {{
     parts.append(config.strip())
 
     # Determine if we need routes/upstreams
-    needs_routes = not has_block(config, 'routes')
-    needs_upstreams = not has_block(config, 'upstreams')
+    needs_routes = 'routes' not in blocks
+    needs_upstreams = 'upstreams' not in blocks
 
     # If config has agents, listeners, or other blocks but no routes, add them
     if needs_routes:
@@ -130,47 +386,47 @@ upstreams {{
     }
 }""")
 
-    completed = "\n\n".join(parts)
+    return WRAPPER_SENTINEL + "\n" + "\n\n".join(parts)
 
-    # Test if completion worked
-    if test_config(completed):
-        return completed
+@functools.lru_cache(maxsize=None)
+def fix_block(kdl_content):
+    """Complete one block, returning (replacement or None, fix or None).
 
-    # If still invalid, return original (we'll report it)
-    return config
+    Cached, so a block copied across many pages is only worked out once.
+    """
+    # Skip if already completed by an earlier run, or already valid
+    if WRAPPER_SENTINEL in kdl_content or is_valid_config(kdl_content):
+        return None, None
+
+    # Try to complete it
+    completed = complete_config(kdl_content)
+
+    # Check if we made progress
+    if completed != kdl_content:
+        if test_config(completed):
+            return completed, "completed"
+        return None, "attempted"
+
+    # Leave the original if we couldn't fix it
+    return None, None
 
 def process_file(file_path):
     """Process a markdown file and complete partial configs."""
-    with open(file_path, 'r', encoding='utf-8') as f:
-        content = f.read()
+    # Fast path: skip regex work for files without KDL blocks
+    content = read_kdl_markdown(file_path)
+    if content is None:
+        return False, []
 
     original = content
     fixes = []
 
-    def fix_kdl_block(match):
-        prefix = match.group(1)
-        kdl_content = match.group(2)
-        suffix = match.group(3)
-
-        # Skip if already valid
-        if test_config(kdl_content):
-            return match.group(0)
-
-        # Try to complete it
-        completed = complete_config(kdl_content)
+    def fix_kdl_block(kdl_content):
+        fixed, fix = fix_block(kdl_content)
+        if fix:
+            fixes.append(fix)
+        return fixed
 
-        # Check if we made progress
-        if completed != kdl_content:
-            if test_config(completed):
-                fixes.append("completed")
-                return prefix + completed + '\n' + suffix
-            else:
-                fixes.append("attempted")
-
-        # Return original if we couldn't fix it
-        return match.group(0)
-
-    content = re.sub(r'(```kdl\n)(.*?)(```)', fix_kdl_block, content, flags=re.DOTALL)
+    content = replace_kdl_blocks(content, fix_kdl_block)
 
     if content != original:
         with open(file_path, 'w', encoding='utf-8') as f:
@@ -186,18 +442,24 @@ def main():
     print()
 
     # Process all markdown files (exclude versioned for now)
-    md_files = sorted(DOCS_DIR.rglob("*.md"))
-    md_files = [f for f in md_files if '/v/' not in str(f)]
+    md_files = find_markdown_files(DOCS_DIR)
+    load_validation_cache()
+
+    # Validate every block, then every completion candidate, in parallel
+    # up front so the per-file pass below only hits TEST_CACHE
+    blocks = [b for b in collect_kdl_blocks(md_files) if WRAPPER_SENTINEL not in b]
+    prevalidate(b for b in blocks if is_complete_config(b))
+    prevalidate(build_completion(b) for b in blocks if not is_valid_config(b))
 
     modified_count = 0
     total_fixed = 0
     total_attempted = 0
 
     for md_file in md_files:
-        rel_path = md_file.relative_to(DOCS_DIR)
         was_modified, fixes = process_file(md_file)
 
         if was_modified:
+            rel_path = md_file.relative_to(DOCS_DIR)
             completed = fixes.count("completed")
             attempted = fixes.count("attempted")
 
@@ -216,5 +478,7 @@ def main():
     if total_attempted > 0:
         print(f"⚠ Attempted but still invalid: {total_attempted} configs")
 
+    save_validation_cache()
+
 if __name__ == "__main__":
     main()
@@ -3,32 +3,37 @@
 Convert newer agent syntax to older syntax for validation.
 """
 
+import functools
 import re
 from pathlib import Path
-import subprocess
-import tempfile
-import os
+
+# Share the validator (and its result cache) with complete_all_configs
+from complete_all_configs import (
+    load_validation_cache, prevalidate, save_validation_cache, test_config,
+)
+from kdl_docs import (
+    collect_kdl_blocks, find_markdown_files, read_kdl_markdown, replace_kdl_blocks,
+)
 
 DOCS_DIR = Path("/Users/zara/Development/github.com/zentinelproxy/zentinelproxy.io-docs/content")
-ZENTINEL_BIN = "/Users/zara/.cargo/bin/zentinel"
-
-def test_config(config_text):
-    """Test if a config is valid."""
-    with tempfile.NamedTemporaryFile(mode='w', suffix='.kdl', delete=False) as f:
-        f.write(config_text)
-        temp_file = f.name
-    try:
-        result = subprocess.run(
-            [ZENTINEL_BIN, '--conf', temp_file, '--test'],
-            capture_output=True,
-            timeout=3
-        )
-        return result.returncode == 0
-    except:
-        return False
-    finally:
-        os.unlink(temp_file)
 
+TRANSPORT_UNIX_RE = re.compile(r'(\s*)transport\s+"unix_socket"\s*\{\s*path\s+"[^"]+"\s*\}')
+TRANSPORT_GRPC_RE = re.compile(r'(\s*)transport\s+"grpc"\s*\{\s*url\s+"[^"]+"\s*\}')
+EVENTS_ARRAY_RE = re.compile(r'(\s*)events\s+\[([^\]]+)\]')
+AGENT_DEF_RE = re.compile(r'agent\s+"[^"]+"\s*\{')
+AGENT_NAME_RE = re.compile(r'(agent\s+"[^"]+")(\s*\{)')
+SCHEMA_CONTENT_RE = re.compile(r'schema-content\s+r#"')
+SCHEMA_CLOSE_RE = re.compile(r'"#\s*\n\s*\}')
+PATH_RE = re.compile(r'path\s+"([^"]+)"')
+URL_RE = re.compile(r'url\s+"([^"]+)"')
+QUOTED_RE = re.compile(r'"([^"]+)"')
+SERVICE_TYPE_BUILTIN_RE = re.compile(r'\s*service-type\s+"builtin"')
+
+# Anything convert_agent_syntax() could rewrite; blocks without a match are
+# left alone without validating them
+NEW_SYNTAX_RE = re.compile(r'transport\s+"|events\s+\[|agent\s+"[^"]+"\s*\{|#"|"#')
+
+@functools.lru_cache(maxsize=None)
 def convert_agent_syntax(config):
     """Convert new agent syntax to old syntax."""
 
@@ -36,7 +41,7 @@ def convert_agent_syntax(config):
     def replace_unix_socket(match):
         # Extract the path from inside the transport block
         transport_block = match.group(0)
-        path_match = re.search(r'path\s+"([^"]+)"', transport_block)
+        path_match = PATH_RE.search(transport_block)
         if path_match:
             path = path_match.group(1)
             # Return old syntax with proper indentation
@@ -44,107 +49,101 @@ def convert_agent_syntax(config):
             return f'{indent}unix-socket "{path}"'
         return match.group(0)
 
-    config = re.sub(
-        r'(\s*)transport\s+"unix_socket"\s*\{\s*path\s+"[^"]+"\s*\}',
-        replace_unix_socket,
-        config
-    )
+    config = TRANSPORT_UNIX_RE.sub(replace_unix_socket, config)
 
     # Pattern 2: Convert transport "grpc" { url "..." } to grpc "..."
     def replace_grpc(match):
         transport_block = match.group(0)
-        url_match = re.search(r'url\s+"([^"]+)"', transport_block)
+        url_match = URL_RE.search(transport_block)
         if url_match:
             url = url_match.group(1)
             indent = match.group(1) if match.group(1) else '    '
             return f'{indent}grpc "{url}"'
         return match.group(0)
 
-    config = re.sub(
-        r'(\s*)transport\s+"grpc"\s*\{\s*url\s+"[^"]+"\s*\}',
-        replace_grpc,
-        config
-    )
+    config = TRANSPORT_GRPC_RE.sub(replace_grpc, config)
 
     # Pattern 3: Convert events ["event1", "event2"] to events "event1" "event2"
     def replace_events_array(match):
         indent = match.group(1)
         events_content = match.group(2)
         # Extract all quoted strings
-        events = re.findall(r'"([^"]+)"', events_content)
+        events = QUOTED_RE.findall(events_content)
         if events:
             events_str = ' '.join(f'"{e}"' for e in events)
             return f'{indent}events {events_str}'
         return match.group(0)
 
-    config = re.sub(
-        r'(\s*)events\s+\[([^\]]+)\]',
-        replace_events_array,
-        config
-    )
+    config = EVENTS_ARRAY_RE.sub(replace_events_array, config)
 
     # Pattern 4: Add type="custom" to agent definitions if missing
     def add_agent_type(match):
         agent_line = match.group(0)
         if 'type=' not in agent_line:
             # Insert type="custom" after the agent name
-            agent_line = re.sub(
-                r'(agent\s+"[^"]+")(\s*\{)',
-                r'\1 type="custom"\2',
-                agent_line
-            )
+            agent_line = AGENT_NAME_RE.sub(r'\1 type="custom"\2', agent_line)
         return agent_line
 
-    config = re.sub(
-        r'agent\s+"[^"]+"\s*\{',
-        add_agent_type,
-        config
-    )
+    config = AGENT_DEF_RE.sub(add_agent_type, config)
 
     # Pattern 5: Remove raw string prefix from schema-content if present
-    config = re.sub(r'schema-content\s+r#"', 'schema-content "', config)
-    config = re.sub(r'"#\s*\n\s*\}', '"\n    }', config)
+    config = SCHEMA_CONTENT_RE.sub('schema-content "', config)
+    config = SCHEMA_CLOSE_RE.sub('"\n    }', config)
 
     return config
 
+def has_new_syntax(config):
+    """Check if config uses any syntax convert_agent_syntax() rewrites."""
+    return NEW_SYNTAX_RE.search(config) is not None
+
+def strip_builtin_service_type(config):
+    """Remove service-type "builtin", which some converted routes reject."""
+    return SERVICE_TYPE_BUILTIN_RE.sub('', config)
+
+@functools.lru_cache(maxsize=None)
+def fix_block(kdl_content):
+    """Convert one block, returning (replacement or None, fix or None).
+
+    Cached, so a block copied across many pages is only worked out once.
+    """
+    # Skip if there is nothing to convert or it's already valid
+    if not has_new_syntax(kdl_content) or test_config(kdl_content):
+        return None, None
+
+    # Apply conversion
+    converted = convert_agent_syntax(kdl_content)
+
+    # Test if conversion worked
+    if converted != kdl_content:
+        if test_config(converted):
+            return converted, "converted"
+        # Try one more time with additional fixes
+        # Sometimes we need to remove service-type for certain routes
+        if 'service-type "builtin"' in converted:
+            converted2 = strip_builtin_service_type(converted)
+            if test_config(converted2):
+                return converted2, "converted+fixed"
+
+    # Leave the original if we couldn't fix it
+    return None, None
+
 def process_file(file_path):
     """Process a markdown file and convert agent syntax."""
-    with open(file_path, 'r', encoding='utf-8') as f:
-        content = f.read()
+    # Fast path: skip regex work for files without KDL blocks
+    content = read_kdl_markdown(file_path)
+    if content is None:
+        return False, 0
 
     original = content
     fixes = []
 
-    def fix_kdl_block(match):
-        prefix = match.group(1)
-        kdl_content = match.group(2)
-        suffix = match.group(3)
-
-        # Skip if already valid
-        if test_config(kdl_content):
-            return match.group(0)
-
-        # Apply conversion
-        converted = convert_agent_syntax(kdl_content)
-
-        # Test if conversion worked
-        if converted != kdl_content:
-            if test_config(converted):
-                fixes.append("converted")
-                return prefix + converted + '\n' + suffix
-            else:
-                # Try one more time with additional fixes
-                # Sometimes we need to remove service-type for certain routes
-                if 'service-type "builtin"' in converted:
-                    converted2 = re.sub(r'\s*service-type\s+"builtin"', '', converted)
-                    if test_config(converted2):
-                        fixes.append("converted+fixed")
-                        return prefix + converted2 + '\n' + suffix
-
-        # Return original if we couldn't fix it
-        return match.group(0)
+    def fix_kdl_block(kdl_content):
+        fixed, fix = fix_block(kdl_content)
+        if fix:
+            fixes.append(fix)
+        return fixed
 
-    content = re.sub(r'(```kdl\n)(.*?)(```)', fix_kdl_block, content, flags=re.DOTALL)
+    content = replace_kdl_blocks(content, fix_kdl_block)
 
     if content != original:
         with open(file_path, 'w', encoding='utf-8') as f:
@@ -160,17 +159,31 @@ def main():
     print()
 
     # Process all markdown files
-    md_files = sorted(DOCS_DIR.rglob("*.md"))
-    md_files = [f for f in md_files if '/v/' not in str(f)]
+    md_files = find_markdown_files(DOCS_DIR)
+    load_validation_cache()
+
+    # Validate every block and each conversion fallback in parallel up
+    # front so the per-file pass below only hits the validation cache
+    blocks = [b for b in collect_kdl_blocks(md_files) if has_new_syntax(b)]
+    prevalidate(blocks)
+    converted = []
+    for block in blocks:
+        if not test_config(block):
+            candidate = convert_agent_syntax(block)
+            if candidate != block:
+                converted.append(candidate)
+    prevalidate(converted)
+    prevalidate(strip_builtin_service_type(c) for c in converted
+                if not test_config(c) and 'service-type "builtin"' in c)
 
     modified_count = 0
     total_fixed = 0
 
     for md_file in md_files:
-        rel_path = md_file.relative_to(DOCS_DIR)
         was_modified, fix_count = process_file(md_file)
 
         if was_modified and fix_count > 0:
+            rel_path = md_file.relative_to(DOCS_DIR)
             print(f"✓ {rel_path} ({fix_count} blocks converted)")
             modified_count += 1
             total_fixed += fix_count
@@ -178,5 +191,7 @@ def main():
     print()
     print(f"Modified {modified_count} files, converted {total_fixed} configs")
 
+    save_validation_cache()
+
 if __name__ == "__main__":
     main()
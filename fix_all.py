@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Run all KDL doc fixers in a single pass over each markdown file:
+1. Replace deprecated 'server' with 'system'
+2. Convert newer agent syntax to older syntax
+3. Complete partial snippets into full valid configs
+4. Wrap anything still incomplete in a minimal config
+
+Every stage shares one validation cache, so a block is validated at most
+once no matter how many fixers look at it.
+"""
+
+import functools
+from pathlib import Path
+
+from complete_all_configs import (
+    build_completion, complete_config, is_valid_config, load_validation_cache,
+    prevalidate, save_validation_cache,
+)
+from convert_agent_syntax import (
+    convert_agent_syntax, has_new_syntax, strip_builtin_service_type,
+)
+from fix_configs import fix_deprecated_server_keyword, wrap_incomplete_snippet
+from kdl_docs import (
+    WRAPPER_SENTINEL, collect_kdl_blocks, find_markdown_files, is_complete_config,
+    read_kdl_markdown, replace_kdl_blocks,
+)
+
+DOCS_DIR = Path("/Users/zara/Development/github.com/zentinelproxy/zentinelproxy.io-docs/content")
+
+def fix_candidates(config):
+    """List the block as-is, plus its agent-syntax conversions if any."""
+    candidates = [(config, None)]
+    if has_new_syntax(config):
+        converted = convert_agent_syntax(config)
+        if converted != config:
+            candidates.append((converted, "converted"))
+            # Some converted routes reject service-type "builtin"
+            if 'service-type "builtin"' in converted:
+                candidates.append((strip_builtin_service_type(converted), "converted+fixed"))
+    return candidates
+
+@functools.lru_cache(maxsize=None)
+def fix_block(kdl_content):
+    """Apply every fixer to one block, returning (fixed_content, changes).
+
+    Cached, so a block copied across many pages is only worked out once.
+    """
+    # Already wrapped or completed by an earlier run
+    if WRAPPER_SENTINEL in kdl_content:
+        return kdl_content, ()
+
+    changes = []
+
+    config = fix_deprecated_server_keyword(kdl_content)
+    if config != kdl_content:
+        changes.append("server->system")
+
+    # Take the first candidate that validates once completed
+    for candidate, change in fix_candidates(config):
+        completed = complete_config(candidate)
+        if is_valid_config(completed):
+            if change:
+                changes.append(change)
+            if completed != candidate:
+                changes.append("completed")
+            return completed, tuple(changes)
+
+    # Nothing validated - fall back to the minimal wrapper like fix_configs
+    if not is_complete_config(config):
+        wrapped = wrap_incomplete_snippet(config)
+        if wrapped != config:
+            config = wrapped
+            changes.append("wrapped snippet")
+
+    return config, tuple(changes)
+
+def process_file(content):
+    """Apply all fixes to the KDL blocks of one file's content.
+
+    Returns (new_content, changes); writing is left to run_pipeline.
+    """
+    changes = []
+
+    def fix_kdl_block(kdl_content):
+        fixed, block_changes = fix_block(kdl_content)
+        if not block_changes:
+            return None
+
+        changes.extend(block_changes)
+        return fixed
+
+    return replace_kdl_blocks(content, fix_kdl_block), changes
+
+def run_pipeline(md_files):
+    """Read each file once, fix it in memory, then write all edits at the end.
+
+    Returns a dict mapping each modified path to its list of changes.
+    """
+    pending = {}
+    results = {}
+
+    for md_file in md_files:
+        # Fast path: skip regex work for files without KDL blocks
+        content = read_kdl_markdown(md_file)
+        if content is None:
+            continue
+
+        new_content, changes = process_file(content)
+        if new_content != content:
+            pending[md_file] = new_content
+            results[md_file] = changes
+
+    # Flush once so a failed run leaves the tree untouched
+    for md_file, new_content in pending.items():
+        with open(md_file, 'w', encoding='utf-8') as f:
+            f.write(new_content)
+
+    return results
+
+def main():
+    print("=" * 80)
+    print("KDL Doc Fixer (all stages)")
+    print("=" * 80)
+    print()
+
+    md_files = find_markdown_files(DOCS_DIR)
+    load_validation_cache()
+
+    # Validate every block and every fix candidate in parallel up front so
+    # the per-file pass below only hits the validation cache
+    blocks = [fix_deprecated_server_keyword(b) for b in collect_kdl_blocks(md_files)
+              if WRAPPER_SENTINEL not in b]
+    candidates = [c for b in blocks for c, _ in fix_candidates(b)]
+    prevalidate(c for c in candidates if is_complete_config(c))
+    prevalidate(build_completion(c) for c in candidates if not is_valid_config(c))
+
+    modified_count = 0
+    total_changes = {
+        "server->system": 0,
+        "converted": 0,
+        "converted+fixed": 0,
+        "completed": 0,
+        "wrapped snippet": 0,
+    }
+
+    for md_file, changes in run_pipeline(md_files).items():
+        rel_path = md_file.relative_to(DOCS_DIR)
+        print(f"✓ {rel_path}")
+        for change in sorted(set(changes)):
+            print(f"  - {change} ({changes.count(change)})")
+            total_changes[change] += changes.count(change)
+        modified_count += 1
+
+    print()
+    print("=" * 80)
+    print(f"Modified {modified_count} files")
+    print(f"  - {total_changes['server->system']} server->system replacements")
+    print(f"  - {total_changes['converted']} agent syntax conversions")
+    print(f"  - {total_changes['converted+fixed']} agent syntax conversions with service-type removed")
+    print(f"  - {total_changes['completed']} configs completed")
+    print(f"  - {total_changes['wrapped snippet']} snippets wrapped")
+
+    save_validation_cache()
+
+if __name__ == "__main__":
+    main()
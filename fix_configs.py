@@ -8,10 +8,21 @@ Fix invalid KDL configs in Zentinel documentation:
 import re
 from pathlib import Path
 
+from kdl_docs import (
+    WRAPPER_SENTINEL, block_openers, find_markdown_files, is_complete_config,
+    read_kdl_markdown, replace_kdl_blocks,
+)
+
 DOCS_DIR = Path("/Users/zara/Development/github.com/zentinelproxy/zentinelproxy.io-docs/content")
 
+SERVER_BLOCK_RE = re.compile(r'\bserver\s*{')
+ROUTE_PRIORITY_RE = re.compile(r'route\s+"[^"]+"\s*\{\s*priority\s+\d+\s*\}\s*$', re.MULTILINE)
+STANDALONE_AGENT_RE = re.compile(r'^\s*agent\s+"[^"]+"\s+type=')
+# Short snippets starting with these are just showing syntax
+SHORT_SYNTAX_PREFIXES = ('listeners {', 'limits {')
+
 # Minimal wrapper for incomplete snippets
-MINIMAL_WRAPPER_TEMPLATE = """// Documentation example - wrapped in minimal config for validation
+MINIMAL_WRAPPER_TEMPLATE = WRAPPER_SENTINEL + """
 system {{
     worker-threads 0
 }}
@@ -27,97 +38,98 @@ listeners {{
 
 {extra_sections}"""
 
-def has_block(config, block_name):
-    """Check if config has a top-level block."""
-    pattern = rf'^\s*{block_name}\s*{{'
-    return bool(re.search(pattern, config, re.MULTILINE))
+# Placeholder for the snippet in WRAPPED_VARIANTS
+CONTENT_MARKER = "__CONTENT__"
+
+DEFAULT_UPSTREAMS = """upstreams {
+    upstream "backend" {
+        targets {
+            target { address "127.0.0.1:3000" }
+        }
+    }
+}"""
 
-def is_complete_config(config):
-    """Check if config has required top-level blocks."""
-    has_system = has_block(config, 'system') or has_block(config, 'server')
-    has_listeners = has_block(config, 'listeners')
-    return has_system and has_listeners
+DEFAULT_ROUTES = """routes {
+    route "default" {
+        matches { path-prefix "/" }
+        upstream "backend"
+    }
+}"""
 
 def fix_deprecated_server_keyword(config):
     """Replace 'server {' with 'system {'."""
-    return re.sub(r'\bserver\s*{', 'system {', config)
+    return SERVER_BLOCK_RE.sub('system {', config)
 
 def should_skip_wrapping(config):
     """Determine if a snippet should not be auto-wrapped."""
+    blocks = block_openers(config)
+    stripped = config.strip()
+
     # Skip if it's just showing route priority (intentional partial example)
-    if re.search(r'route\s+"[^"]+"\s*\{\s*priority\s+\d+\s*\}\s*$', config.strip(), re.MULTILINE):
+    if ROUTE_PRIORITY_RE.search(stripped):
         return True
 
     # Skip standalone waf config blocks (documentation-only)
-    if config.strip().startswith('waf {') and not has_block(config, 'agents'):
+    if stripped.startswith('waf {') and 'agents' not in blocks:
         return True
 
     # Skip standalone agent definitions (not in agents block)
-    if re.match(r'^\s*agent\s+"[^"]+"\s+type=', config.strip()) and not has_block(config, 'agents'):
+    if STANDALONE_AGENT_RE.match(stripped) and 'agents' not in blocks:
         return True
 
     # Skip very short blocks that are clearly just showing syntax
-    if len(config.strip().split('\n')) <= 5 and (
-        config.strip().startswith('listeners {') or
-        config.strip().startswith('limits {')
-    ):
+    if stripped.count('\n') < 5 and stripped.startswith(SHORT_SYNTAX_PREFIXES):
         return True
 
     return False
 
-def wrap_incomplete_snippet(config):
-    """Wrap an incomplete snippet in a minimal valid config."""
-    if should_skip_wrapping(config):
-        return config
-
+def build_wrapper(has_routes, has_upstreams):
+    """Fill MINIMAL_WRAPPER_TEMPLATE with the sections a snippet is missing."""
     extra_sections = []
 
     # If config has routes, ensure it has upstreams
-    if has_block(config, 'routes') and not has_block(config, 'upstreams'):
-        extra_sections.append("""upstreams {
-    upstream "backend" {
-        targets {
-            target { address "127.0.0.1:3000" }
-        }
-    }
-}""")
+    if has_routes and not has_upstreams:
+        extra_sections.append(DEFAULT_UPSTREAMS)
 
     # If config doesn't have routes, add a default one
-    if not has_block(config, 'routes'):
-        if not has_block(config, 'upstreams'):
-            extra_sections.append("""upstreams {
-    upstream "backend" {
-        targets {
-            target { address "127.0.0.1:3000" }
-        }
-    }
-}""")
-        extra_sections.append("""routes {
-    route "default" {
-        matches { path-prefix "/" }
-        upstream "backend"
-    }
-}""")
+    if not has_routes:
+        if not has_upstreams:
+            extra_sections.append(DEFAULT_UPSTREAMS)
+        extra_sections.append(DEFAULT_ROUTES)
 
     return MINIMAL_WRAPPER_TEMPLATE.format(
-        content=config,
+        content=CONTENT_MARKER,
         extra_sections="\n\n".join(extra_sections)
-    ).strip()
+    )
+
+# Precomputed wrapper for each (has_routes, has_upstreams) combination
+WRAPPED_VARIANTS = {
+    (has_routes, has_upstreams): build_wrapper(has_routes, has_upstreams)
+    for has_routes in (False, True)
+    for has_upstreams in (False, True)
+}
+
+def wrap_incomplete_snippet(config):
+    """Wrap an incomplete snippet in a minimal valid config."""
+    if should_skip_wrapping(config):
+        return config
+
+    blocks = block_openers(config)
+    wrapper = WRAPPED_VARIANTS['routes' in blocks, 'upstreams' in blocks]
+    return wrapper.replace(CONTENT_MARKER, config).strip()
 
 def process_file(file_path):
     """Process a markdown file and fix KDL configs."""
-    with open(file_path, 'r', encoding='utf-8') as f:
-        content = f.read()
+    # Fast path: skip regex work for files without KDL blocks
+    content = read_kdl_markdown(file_path)
+    if content is None:
+        return False, []
 
     original_content = content
     changes = []
 
     # Find and fix all ```kdl ... ``` blocks
-    def replace_kdl_block(match):
-        prefix = match.group(1)
-        kdl_content = match.group(2)
-        suffix = match.group(3)
-
+    def replace_kdl_block(kdl_content):
         original_kdl = kdl_content
         modified = False
 
@@ -135,9 +147,9 @@ def process_file(file_path):
                 modified = True
                 changes.append("wrapped snippet")
 
-        return prefix + kdl_content + '\n' + suffix
+        return kdl_content if modified else None
 
-    content = re.sub(r'(```kdl\n)(.*?)(```)', replace_kdl_block, content, flags=re.DOTALL)
+    content = replace_kdl_blocks(content, replace_kdl_block)
 
     # Only write if changed
     if content != original_content:
@@ -153,8 +165,7 @@ def main():
     print()
 
     # Process all markdown files (exclude versioned for now)
-    md_files = sorted(DOCS_DIR.rglob("*.md"))
-    md_files = [f for f in md_files if '/v/' not in str(f)]
+    md_files = find_markdown_files(DOCS_DIR)
 
     modified_count = 0
     total_changes = {
@@ -163,10 +174,10 @@ def main():
     }
 
     for md_file in md_files:
-        rel_path = md_file.relative_to(DOCS_DIR)
         was_modified, changes = process_file(md_file)
 
         if was_modified:
+            rel_path = md_file.relative_to(DOCS_DIR)
             print(f"✓ {rel_path}")
             for change in changes:
                 print(f"  - {change}")
@@ -6,8 +6,23 @@ Fix invalid KDL snippets by wrapping them in minimal valid configurations.
 import re
 from pathlib import Path
 
+from kdl_docs import (
+    block_openers, find_markdown_files, is_complete_config, read_kdl_markdown,
+    replace_kdl_blocks,
+)
+
 DOCS_DIR = Path("/Users/zara/Development/github.com/zentinelproxy/zentinelproxy.io-docs/content")
 
+ROUTE_PRIORITY_RE = re.compile(r'route\s+"[^"]+"\s*\{\s*priority\s+\d+\s*\}')
+
+# Standalone blocks, e.g.:
+# - waf { ... }
+# - agent "..." { ... }
+# - route "..." { priority ... } (just a route with priority)
+STANDALONE_RE = re.compile(
+    r'^\s*(?:waf\s*\{|agent\s+["\']|route\s+["\'].*\{\s*priority)', re.MULTILINE
+)
+
 # Minimal boilerplate for wrapping snippets
 MINIMAL_WRAPPER = """system {{
     worker-threads 0
@@ -24,51 +39,35 @@ listeners {{
 
 {extra_blocks}"""
 
-def has_top_level_block(config, block_name):
-    """Check if config has a top-level block (e.g., 'routes', 'agents')."""
-    pattern = rf'^\s*{block_name}\s*{{'
-    return re.search(pattern, config, re.MULTILINE) is not None
-
-def is_complete_config(config):
-    """Check if a KDL config is complete (has required top-level blocks)."""
-    # A complete config should have at least system/server and listeners
-    has_system = has_top_level_block(config, 'system') or has_top_level_block(config, 'server')
-    has_listeners = has_top_level_block(config, 'listeners')
-    return has_system and has_listeners
-
-def is_standalone_block(config):
-    """Check if this is a standalone block like 'waf { ... }' or 'agent \"name\" { ... }'."""
-    # Match patterns like:
-    # - waf { ... }
-    # - agent "..." { ... }
-    # - route "..." { ... }
-    patterns = [
-        r'^\s*waf\s*\{',
-        r'^\s*agent\s+["\']',
-        r'^\s*route\s+["\'].*\{\s*priority',  # Just a route with priority
-    ]
-    for pattern in patterns:
-        if re.search(pattern, config, re.MULTILINE):
-            # Make sure it's not part of a larger config
-            if not has_top_level_block(config, 'routes') or config.strip().startswith('waf'):
-                return True
-    return False
+def is_standalone_block(config, stripped):
+    """Check if this is a standalone block like 'waf { ... }' or 'agent \"name\" { ... }'.
 
-def wrap_snippet(config):
-    """Wrap a partial snippet in a minimal valid configuration."""
+    stripped is config.strip(), computed once by the caller.
+    """
+    if not STANDALONE_RE.search(config):
+        return False
+    # Make sure it's not part of a larger config
+    return 'routes' not in block_openers(config) or stripped.startswith('waf')
+
+def wrap_snippet(config, stripped):
+    """Wrap a partial snippet in a minimal valid configuration.
+
+    stripped is config.strip(), computed once by the caller.
+    """
     # Detect what kind of snippet this is
-    has_routes = has_top_level_block(config, 'routes')
-    has_upstreams = has_top_level_block(config, 'upstreams')
-    has_agents = has_top_level_block(config, 'agents')
+    blocks = block_openers(config)
+    has_routes = 'routes' in blocks
+    has_upstreams = 'upstreams' in blocks
+    has_agents = 'agents' in blocks
 
     extra_blocks = []
 
     # If it's a standalone agent block, wrap in agents { }
-    if is_standalone_block(config):
-        if config.strip().startswith('agent'):
+    if is_standalone_block(config, stripped):
+        if stripped.startswith('agent'):
             config = f"agents {{\n    {config}\n}}"
             has_agents = True
-        elif config.strip().startswith('waf'):
+        elif stripped.startswith('waf'):
             # waf blocks are special, they need to be in agents as an agent definition
             # Actually, looking at the errors, these seem to be configuration-only blocks
             # Let's skip these for now - they might be intentional snippets
@@ -111,37 +110,30 @@ def wrap_snippet(config):
 
 def process_file(file_path):
     """Process a markdown file and wrap partial KDL snippets."""
-    with open(file_path, 'r', encoding='utf-8') as f:
-        content = f.read()
-
-    # Find all ```kdl ... ``` blocks
-    pattern = r'(```kdl\n)(.*?)(```)'
-
-    def replace_kdl_block(match):
-        prefix = match.group(1)
-        kdl_content = match.group(2)
-        suffix = match.group(3)
+    # Fast path: skip regex work for files without KDL blocks
+    content = read_kdl_markdown(file_path)
+    if content is None:
+        return False
 
+    def replace_kdl_block(kdl_content):
         # Skip if already complete
         if is_complete_config(kdl_content):
-            return match.group(0)
+            return None
+
+        stripped = kdl_content.strip()
 
         # Skip waf standalone blocks (they're documentation-only)
-        if is_standalone_block(kdl_content) and kdl_content.strip().startswith('waf'):
-            return match.group(0)
+        if stripped.startswith('waf') and is_standalone_block(kdl_content, stripped):
+            return None
 
         # Skip route priority examples (incomplete by design)
-        if re.search(r'route\s+"[^"]+"\s*\{\s*priority\s+\d+\s*\}', kdl_content):
-            return match.group(0)
-
-        # Try to wrap the snippet
-        wrapped = wrap_snippet(kdl_content)
-        if wrapped is None:
-            return match.group(0)
+        if ROUTE_PRIORITY_RE.search(kdl_content):
+            return None
 
-        return prefix + wrapped + '\n' + suffix
+        # Try to wrap the snippet (None if it should stay as-is)
+        return wrap_snippet(kdl_content, stripped)
 
-    modified_content = re.sub(pattern, replace_kdl_block, content, flags=re.DOTALL)
+    modified_content = replace_kdl_blocks(content, replace_kdl_block)
 
     # Only write if changed
     if modified_content != content:
@@ -157,14 +149,13 @@ def main():
     print()
 
     # Get all markdown files (excluding versioned)
-    md_files = sorted(DOCS_DIR.rglob("*.md"))
-    md_files = [f for f in md_files if '/v/' not in str(f)]
+    md_files = find_markdown_files(DOCS_DIR)
 
     modified_count = 0
 
     for md_file in md_files:
-        rel_path = md_file.relative_to(DOCS_DIR)
         if process_file(md_file):
+            rel_path = md_file.relative_to(DOCS_DIR)
             print(f"✓ Modified: {rel_path}")
             modified_count += 1
 
@@ -0,0 +1,185 @@
+"""
+Shared helpers for finding, scanning and rewriting ```kdl blocks in the
+markdown docs. Nothing here runs zentinel.
+"""
+
+import functools
+import os
+import re
+import shutil
+import subprocess
+from pathlib import Path
+
+# Fenced ```kdl blocks in markdown
+KDL_BLOCK_RE = re.compile(r'(```kdl\n)(.*?)(```)', re.DOTALL)
+
+# KDL strings and comments, shared by every scanner so text inside them is
+# never mistaken for structure
+KDL_STRINGS_AND_COMMENTS = r"""
+      //[^\n]*                                  # line comment
+    | /\*                                       # block comment (nesting handled in code)
+    | (?<![\w-])r(?P<v1>\#*)".*?"(?P=v1)        # KDL v1 raw string: r"..." / r#"..."#
+    | (?P<v2>\#+)".*?"(?P=v2)                   # KDL v2 raw string: #"..."#
+    | "(?:[^"\\]|\\.)*"                          # quoted string
+"""
+# KDL tokens that matter for well-formedness: comments, strings and braces.
+# A bare '"' only matches when no string alternative could close it.
+KDL_LEXICAL_RE = re.compile(KDL_STRINGS_AND_COMMENTS + r"""
+    | [{}"]
+""", re.VERBOSE | re.DOTALL)
+# Nodes opening a block at the start of a line, outside strings and comments
+BLOCK_OPENER_RE = re.compile(KDL_STRINGS_AND_COMMENTS + r"""
+    | ^[ \t]*(?P<opener>[A-Za-z_][\w-]*)\s*\{
+""", re.VERBOSE | re.DOTALL | re.MULTILINE)
+BLOCK_COMMENT_RE = re.compile(r'/\*|\*/')
+
+# First line of every config this pipeline wraps or completes, so re-runs
+# can recognise their own output
+WRAPPER_SENTINEL = "// Documentation example - wrapped in minimal config for validation"
+
+def is_well_formed(config_text):
+    """Check that braces balance and strings/comments are terminated.
+
+    zentinel rejects anything failing this check, so it is a free,
+    in-process way to skip a subprocess for broken snippets.
+    """
+    depth = 0
+    pos = 0
+    while True:
+        match = KDL_LEXICAL_RE.search(config_text, pos)
+        if match is None:
+            return depth == 0
+        token = match.group(0)
+        pos = match.end()
+        if token == '{':
+            depth += 1
+        elif token == '}':
+            depth -= 1
+            if depth < 0:
+                return False
+        elif token == '"':
+            # Unterminated string
+            return False
+        elif token == '/*':
+            pos = skip_block_comment(config_text, pos)
+            if pos is None:
+                return False
+
+def skip_block_comment(config_text, pos):
+    """Return the position after a (possibly nested) block comment, or None."""
+    nesting = 1
+    while nesting:
+        match = BLOCK_COMMENT_RE.search(config_text, pos)
+        if match is None:
+            return None
+        nesting += 1 if match.group(0) == '/*' else -1
+        pos = match.end()
+    return pos
+
+def find_markdown_files(docs_dir):
+    """Find markdown files under docs_dir that may hold KDL, pruning `v/` trees.
+
+    When ripgrep is installed its parallel walker lists only the files that
+    contain a ```kdl fence; otherwise every markdown file is returned.
+    """
+    kdl_files = find_kdl_files_with_rg(docs_dir)
+    if kdl_files is not None:
+        return kdl_files
+
+    md_files = []
+    for root, dirs, files in os.walk(docs_dir):
+        dirs[:] = [d for d in dirs if d != 'v']
+        md_files.extend(Path(root, name) for name in files if name.endswith('.md'))
+    return sorted(md_files)
+
+def find_kdl_files_with_rg(docs_dir):
+    """List markdown files containing ```kdl using ripgrep, or None if unavailable."""
+    rg = shutil.which('rg')
+    if rg is None:
+        return None
+    try:
+        result = subprocess.run(
+            [rg, '--files-with-matches', '--null', '--fixed-strings',
+             '--no-ignore', '--hidden', '--glob', '*.md', '--glob', '!v/',
+             '```kdl', str(docs_dir)],
+            capture_output=True,
+            text=True
+        )
+    except OSError:
+        return None
+    # Exit code 1 just means no file matched
+    if result.returncode not in (0, 1):
+        return None
+    return sorted(Path(name) for name in result.stdout.split('\0') if name)
+
+def read_kdl_markdown(file_path):
+    """Read a markdown file, or return None if it has no ```kdl blocks."""
+    with open(file_path, 'rb') as f:
+        raw = f.read()
+    # Check the raw bytes so files without KDL are never decoded
+    if b'```kdl' not in raw:
+        return None
+    # Normalise newlines like a text-mode read, so KDL_BLOCK_RE sees
+    # "```kdl\n" in CRLF files too
+    return raw.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n')
+
+def collect_kdl_blocks(md_files):
+    """Collect the distinct ```kdl block contents in the given files.
+
+    Docs copy the same examples across many pages, so each distinct block
+    is listed once, in first-seen order.
+    """
+    blocks = {}
+    for md_file in md_files:
+        content = read_kdl_markdown(md_file)
+        if content is not None:
+            blocks.update(dict.fromkeys(m.group(2) for m in KDL_BLOCK_RE.finditer(content)))
+    return list(blocks)
+
+@functools.lru_cache(maxsize=None)
+def block_openers(config):
+    """Return the names of the nodes that open a block at the start of a line.
+
+    As with the original per-name regexes, nested blocks count too, so
+    namespace examples with their own routes/upstreams don't get defaults.
+    Strings and comments are skipped with the same rules as is_well_formed().
+    """
+    blocks = set()
+    pos = 0
+    while True:
+        match = BLOCK_OPENER_RE.search(config, pos)
+        if match is None:
+            return frozenset(blocks)
+        pos = match.end()
+        if match.group('opener'):
+            blocks.add(match.group('opener'))
+        elif match.group(0) == '/*':
+            pos = skip_block_comment(config, pos)
+            if pos is None:
+                return frozenset(blocks)
+
+@functools.lru_cache(maxsize=None)
+def is_complete_config(config):
+    """Check if config opens the required system/listeners blocks."""
+    blocks = block_openers(config)
+    return ('system' in blocks or 'server' in blocks) and 'listeners' in blocks
+
+def replace_kdl_blocks(content, fix_block):
+    """Rewrite ```kdl blocks, copying untouched text through as slices.
+
+    fix_block gets each block's contents and returns the replacement, or
+    None to leave the block as-is. Returns content itself if nothing changed.
+    """
+    parts = []
+    pos = 0
+    for match in KDL_BLOCK_RE.finditer(content):
+        fixed = fix_block(match.group(2))
+        if fixed is None:
+            continue
+        parts.append(content[pos:match.start()])
+        parts.append(match.group(1) + fixed + '\n' + match.group(3))
+        pos = match.end()
+    if not parts:
+        return content
+    parts.append(content[pos:])
+    return ''.join(parts)